@@ -35,6 +35,7 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # details
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        thisHub = hass.data[DOMAIN].pop(entry.entry_id)
+        await thisHub.async_shutdown()
 
     return unload_ok
@@ -1,38 +1,31 @@
 """Platform for sensor integration."""
 from __future__ import annotations
 
+import contextlib
+from functools import partial
 from typing import Any
-import threading
 
 # These constants are relevant to the type of entity we are using.
 # See below for how they are used.
 from homeassistant.components.cover import (
-	ATTR_POSITION,
 	CoverEntity,
 	CoverDeviceClass,
 	CoverEntityFeature,
 )
 
-from homeassistant.const import (
-    CONF_DEVICE_CLASS,
-    CONF_NAME,
-    CONF_OPTIMISTIC,
-    CONF_VALUE_TEMPLATE,
-    STATE_CLOSED,
-    STATE_CLOSING,
-    STATE_OPEN,
-    STATE_OPENING,
-)
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.device_registry import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
 
 from .const import DOMAIN
 import asyncio
-import time
 
 from viam.components.motor import MotorClient
+from viam import logging
+
+LOGGER = logging.getLogger(__name__)
 
 # This function is called as part of the __init__.async_setup_entry (via the
 # hass.config_entries.async_forward_entry_setup call)
@@ -52,19 +45,34 @@ async def async_setup_entry(
 	async_add_entities(ViamCover(hub, motorName) for motorName in motorNames)
 
 class ViamCover(CoverEntity):
-	device_class = CoverDeviceClass.WINDOW
+	# These never change for the lifetime of the entity, so they are plain _attr_
+	# values rather than properties HA has to call on every state write.
+	_attr_device_class = CoverDeviceClass.WINDOW
 	# The supported features of a cover are done using a bitmask. Using the constants
 	# imported above, we can tell HA the features that are supported by this entity.
 	# If the supported features were dynamic (ie: different depending on the external
 	# device it connected to), then this should be function with an @property decorator.
-	supported_features = CoverEntityFeature.STOP | CoverEntityFeature.OPEN | CoverEntityFeature.CLOSE
+	_attr_supported_features = CoverEntityFeature.STOP | CoverEntityFeature.OPEN | CoverEntityFeature.CLOSE
+	# We do optimistic updates
+	_attr_assumed_state = True
 
 	def __init__(self, hub, motorName) -> None:
 		self._name = motorName
 		self.hub = hub
 		self._moving = 0
 		self._closed = False
-		self._state = None
+		self._motor: MotorClient | None = None
+		# go_for bound to the cached motor with the open/close arguments
+		self._open_call = None
+		self._close_call = None
+		# The open/close running in the background, and the name of its action
+		self._pending: asyncio.Task | None = None
+		self._pending_action = None
+		# Every move task that hasn't ended yet, including cancelled ones still
+		# stopping the motor
+		self._running: set[asyncio.Task] = set()
+		# What HA saw on our last state write
+		self._written_state = None
 
 		self._attr_unique_id = f"{self._name}_cover"
 
@@ -72,30 +80,50 @@ class ViamCover(CoverEntity):
 		# is used as the device name for device screens in the UI. This name is used on
 		# entity screens, and used to build the Entity ID that's used is automations etc.
 		self._attr_name = self._name
+		self._attr_device_info = DeviceInfo(
+			identifiers={(DOMAIN, self._name)},
+			# If desired, the name for the device could be different to the entity
+			name=self._name,
+		)
 
-	@property
-	def assumed_state(self) -> bool:
-		"""Return true if we do optimistic updates."""
-		return True
+	async def async_added_to_hass(self) -> None:
+		"""Run when this Entity has been added to HA."""
+		# The hub drops its clients on reconnect, so the cached motor client
+		# must be rebuilt on the new channel.
+		self.hub.register_callback(self._forget_motor)
+		# Build the motor client now so the first command doesn't pay for it
+		if self.available:
+			await self._get_motor()
 
-	@property
-	def name(self) -> str:
-		"""Return the display name of this motor."""
-		return self._name
-	
-	@property
-	def device_info(self) -> DeviceInfo:
-		"""Information about this entity/device."""
-		return {
-			"identifiers": {(DOMAIN, self._name)},
-			# If desired, the name for the device could be different to the entity
-			"name": self._name,
-		}
+	async def async_will_remove_from_hass(self) -> None:
+		"""Entity being removed from hass."""
+		self.hub.remove_callback(self._forget_motor)
+
+	def _forget_motor(self) -> None:
+		"""Forget the motor client so the next command builds a fresh one."""
+		self._motor = None
+		self._open_call = None
+		self._close_call = None
+
+	async def _get_motor(self) -> MotorClient | None:
+		"""Return the cached motor client, building it on first use.
+
+		Returns None if the hub can't reach the robot right now.
+		"""
+		if self._motor is None:
+			robot = await self.hub.get_robot()
+			if robot is None:
+				return None
+			motor = MotorClient(name=self._name, channel=robot._channel)
+			self._open_call = partial(motor.go_for, rpm=60, revolutions=70)
+			self._close_call = partial(motor.go_for, rpm=60, revolutions=-90)
+			self._motor = motor
+		return self._motor
 
 	# This property is important to let HA know if this entity is online or not.
 	# If an entity is offline (return False), the UI will refelect this.
 	@property
-	def available(self, *args, **kwargs) -> bool:
+	def available(self) -> bool:
 		"""Return True if hub is available."""
 		return self.hub.online
 	
@@ -108,53 +136,143 @@ class ViamCover(CoverEntity):
 	# property of the object. In the case of a cover, see the following for more
 	# details: https://developers.home-assistant.io/docs/core/entity/cover/
 
+	# While the hub is offline we can't know what the motor is doing, so report
+	# no motion and no closed state instead of stale values.
+
 	@property
-	def is_closed(self) -> bool:
+	def is_closed(self) -> bool | None:
 		"""Return if the cover is closed, same as position 0."""
+		if not self.hub.online:
+			return None
 		return self._closed
 
 	@property
 	def is_closing(self) -> bool:
 		"""Return if the cover is closing or not."""
-		return self._moving < 0
+		return self.hub.online and self._moving < 0
 
 	@property
 	def is_opening(self) -> bool:
 		"""Return if the cover is opening or not."""
-		return self._moving > 0
+		return self.hub.online and self._moving > 0
+
+	def _state_tuple(self) -> tuple:
+		"""Return everything the state properties above are computed from."""
+		return (self.hub.online, self._moving, self._closed)
+
+	def _write_if_changed(self) -> None:
+		"""Write state to HA, unless nothing it can see changed since the last write."""
+		state = self._state_tuple()
+		if state != self._written_state:
+			self._written_state = state
+			self.async_write_ha_state()
 
 	# These methods allow HA to tell the actual device what to do. In this case, move
 	# the cover to the desired position, or open and close it all the way.
 	async def async_open_cover(self, **kwargs: Any) -> None:
 		"""Open the cover."""
-		asyncio.create_task(self.do_open())
+		self._run_in_background(self.do_open)
 
 	async def async_close_cover(self, **kwargs: Any) -> None:
 		"""Close the cover."""
-		asyncio.create_task(self.do_close())
+		self._run_in_background(self.do_close)
+
+	def _run_in_background(self, action) -> None:
+		"""Run a motor command without holding up the service call.
+
+		Repeating the command that is already running is a no-op, so mashing the
+		button doesn't send the motor duplicate RPCs. A different command cancels
+		the running one first. The task is kept so stop can cancel it.
+		"""
+		# Compared by name, the callable itself may be a fresh object each call
+		name = action.__name__
+		previous = self._pending
+		if previous is not None and not previous.done():
+			if self._pending_action == name:
+				return
+			previous.cancel()
+		self._pending_action = name
+		# Wait on every move still running, not just the last one: a move that
+		# was cancelled before it started never waited on its own predecessor
+		task = asyncio.create_task(self._run_after(tuple(self._running), action))
+		self._running.add(task)
+		task.add_done_callback(self._move_done)
+		self._pending = task
+
+	def _move_done(self, task: asyncio.Task) -> None:
+		"""Forget a finished move, and log its error since nothing awaits it."""
+		self._running.discard(task)
+		if not task.cancelled() and (exc := task.exception()) is not None:
+			LOGGER.error("Moving %s failed: %r", self._name, exc)
+
+	async def _run_after(self, previous: tuple[asyncio.Task, ...], action) -> None:
+		"""Run action once the moves it replaces have fully stopped."""
+		# Let their cancel-time motor.stop() land before our go_for, and their
+		# final state writes happen before ours
+		cancelled = False
+		while not all(task.done() for task in previous):
+			try:
+				await asyncio.wait(previous)
+			except asyncio.CancelledError:
+				# Replaced in turn before we started. Still don't end before the
+				# moves we replaced, or our successor would race their stop().
+				cancelled = True
+		if cancelled:
+			raise asyncio.CancelledError
+		await action()
 
 	async def async_stop_cover(self, **kwargs):
 		"""Stop the cover."""
 		if self.available:
-			robot = await self.hub.setup_viam_conn()
-			motor = MotorClient(name=self._name, channel=robot._channel)
-			await motor.stop()
-			self._moving = 0
+			pending = self._pending
+			if pending is not None and not pending.done():
+				# Cancelling the move stops the motor and writes the final state,
+				# see _move
+				pending.cancel()
+				await asyncio.wait([pending])
+			else:
+				motor = self._motor or await self._get_motor()
+				if motor is None:
+					return
+				try:
+					await motor.stop()
+				except Exception:
+					# The channel may be broken, rebuild the client next time
+					self._forget_motor()
+					raise
+				self._moving = 0
+				self._write_if_changed()
 
 	async def do_open(self, **kwargs: Any) -> None:
 		"""Open the cover."""
-		if self.available:
-			robot = await self.hub.setup_viam_conn()
-			motor = MotorClient(name=self._name, channel=robot._channel)
-			await motor.go_for(rpm= 60, revolutions= 70)
-			self._closed = False
-			self._state = STATE_OPEN
+		await self._move(1)
 
 	async def do_close(self, **kwargs: Any) -> None:
 		"""Close the cover."""
-		if self.available:
-			robot = await self.hub.setup_viam_conn()
-			motor = MotorClient(name=self._name, channel=robot._channel)
-			await motor.go_for(rpm= 60, revolutions= -90)
-			self._closed = True
-			self._state = STATE_CLOSED
+		await self._move(-1)
+
+	async def _move(self, direction: int) -> None:
+		"""Run the motor all the way open (1) or closed (-1)."""
+		if not self.available:
+			return
+		motor = self._motor or await self._get_motor()
+		if motor is None:
+			return
+		call = self._open_call if direction > 0 else self._close_call
+		self._moving = direction
+		self._write_if_changed()
+		try:
+			await call()
+			self._closed = direction < 0
+		except asyncio.CancelledError:
+			# Stopped by the user or HA shutting down, don't leave the motor running
+			with contextlib.suppress(Exception):
+				await asyncio.wait_for(motor.stop(), timeout=5.0)
+			raise
+		except Exception:
+			# The channel may be broken, rebuild the client next time
+			self._forget_motor()
+			raise
+		finally:
+			self._moving = 0
+			self._write_if_changed()
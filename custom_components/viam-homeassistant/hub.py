@@ -1,18 +1,19 @@
 """A demonstration 'hub' that connects several devices."""
 from __future__ import annotations
 
+from collections.abc import Callable
+import contextlib
+import time
+
 # In a real implementation, this would be in an external library that's on PyPI.
 # The PyPI package needs to be included in the `requirements` section of manifest.json
 # See https://developers.home-assistant.io/docs/creating_integration_manifest
 # for more information.
 import asyncio
-import async_timeout
 import random
-import concurrent.futures
 
 from homeassistant.core import HomeAssistant
 from viam.robot.client import RobotClient
-from viam.rpc.dial import Credentials, DialOptions, dial_direct
 from viam import logging
 
 LOGGER = logging.getLogger(__name__)
@@ -21,6 +22,38 @@ class Hub:
 
 	manufacturer = "Demonstration Corp"
 
+	__slots__ = (
+		"_api_key",
+		"_api_key_id",
+		"_callbacks",
+		"_connect_future",
+		"_connected",
+		"_grow_task",
+		"_hass",
+		"_host",
+		"_id",
+		"_last_check",
+		"_liveness_every",
+		"_log_name",
+		"_loop_every",
+		"_loop_task",
+		"_motor_names",
+		"_pool_lock",
+		"_pool_size",
+		"_pool_target",
+		"_reconnect_cond",
+		"_reconnect_gen",
+		"_reconnect_seen",
+		"_resources_future",
+		"_robot",
+		"_robot_pool",
+		"_rr",
+		"_sensor_names",
+		"_timeout",
+		"_tries",
+		"_wait_task",
+	)
+
 	def __init__(self,
 		hass: HomeAssistant,
 		host: str,
@@ -34,17 +67,43 @@ class Hub:
 		self._api_key = api_key
 		# The task containing the infinite reconnect loop while running
 		self._loop_every = 20.0 # Check if we can connect every this many seconds
+		self._liveness_every = 10.0 # Trust a status check for this many seconds
+		self._last_check = 0.0 # time.monotonic() of the last good status check
 		self._timeout = 45.0 # Fail if we don't connect in this many seconds
 		self._loop_task: Optional[asyncio.Task[None]] = None
-		self._reconnect_event = asyncio.Event()
+		# Reconnect requests bump the generation; the loop serves every request
+		# up to the generation it saw with a single probe.
+		self._reconnect_gen = 0
+		self._reconnect_seen = 0
+		self._reconnect_cond = asyncio.Condition()
+		# Only the reconnect loop writes these, and asyncio never switches tasks
+		# between a read and a write without an await, so they need no locks.
 		self._connected = True
-		self._connected_lock = asyncio.Lock()
 		self._tries = 0
-		self._tries_lock = asyncio.Lock()
 		self._wait_task: Optional[asyncio.Task[None]] = None
-		self._wait_task_lock = asyncio.Lock()
 		self._log_name = self._id
 		self._robot = None
+		# Extra clients dialed to the same host so concurrent commands don't
+		# all multiplex onto one HTTP/2 connection. The primary robot is
+		# always the first entry. Every RobotClient runs its own connection
+		# checks and session heartbeat, so keep just one spare: enough that a
+		# long go_for doesn't queue the sensor reads behind it.
+		self._robot_pool: list[RobotClient] = []
+		self._pool_size = 2
+		self._pool_target = self._pool_size
+		self._pool_lock = asyncio.Lock()
+		self._grow_task: Optional[asyncio.Task[None]] = None
+		self._rr = 0
+		# Filtered resource names, fetched once and dropped when the connection is lost
+		self._motor_names: list[str] | None = None
+		self._sensor_names: list[str] | None = None
+		# In-flight fetch shared by platforms setting up at the same time
+		self._resources_future: asyncio.Future[None] | None = None
+		# In-flight check/dial shared by everyone calling setup_viam_conn at once
+		self._connect_future: asyncio.Future[RobotClient | None] | None = None
+		# Called whenever the robot clients are closed, so entities can drop
+		# anything bound to the old channels
+		self._callbacks: set[Callable[[], None]] = set()
 
 	@property
 	def hub_id(self) -> str:
@@ -56,73 +115,226 @@ class Hub:
 
 	async def test_connection(self) -> bool:
 		"""Test connectivity to the hub is OK."""
-		try: 
+		try:
+			# One deadline for the whole probe, connecting included
+			async with asyncio.timeout(self._timeout):
+				if not await self._test_connection():
+					return False
+				await self._check_pool()
+				return True
+		except TimeoutError:
+			LOGGER.warning("test conn %s timed out after %.0f seconds", self._log_name, self._timeout)
+			await self._close_robots()
+			return False
+
+	async def _test_connection(self) -> bool:
+		try:
 			robot = await self.setup_viam_conn()
 			if robot is not None:
+				if time.monotonic() - self._last_check < self._liveness_every:
+					# setup_viam_conn just checked the status, don't ask again
+					return True
 				try:
-					status = await asyncio.wait_for(self._robot.get_machine_status(), timeout=10)
+					# A hung RPC on an open connection should fail fast, not use up
+					# the whole connect deadline
+					status = await asyncio.wait_for(robot.get_machine_status(), timeout=10)
 					if len(status.resources) > 0:
+						self._last_check = time.monotonic()
 						return True
-					await robot.close()
-					self._robot = None
+					LOGGER.warning("test conn %s: no status resources", self._log_name)
+					await self._close_robots()
 					return False
 				except Exception as exc:
-					await robot.close()
 					LOGGER.error("test conn excepted! %s", exc)
-					self._robot = None
-					LOGGER.warn("test conn except 1")
+					await self._close_robots()
 					return False
 			LOGGER.warn("none robot")
 			return False
-		except:
-			LOGGER.warn("test conn except2")
+		except Exception as exc:
+			# _try_connect logs the failure, keep the details for debugging
+			LOGGER.debug("test conn %s failed: %s", self._log_name, exc)
 			return False
 
+	async def get_robot(self):
+		"""Return a robot client from the pool, dialing only if there is none.
+
+		The reconnect loop already health-checks the connection, so commands
+		should not pay for another status RPC on every call. Clients are handed
+		out round-robin; the pool grows in the background up to its target size.
+		"""
+		if self._robot is None or not self._connected:
+			return await self.setup_viam_conn()
+		pool = self._robot_pool
+		if len(pool) < self._pool_target and (self._grow_task is None or self._grow_task.done()):
+			# Keep a reference, the event loop only holds tasks weakly
+			self._grow_task = asyncio.create_task(self._grow_pool())
+		self._rr = (self._rr + 1) % len(pool)
+		return pool[self._rr]
+
+	async def _grow_pool(self) -> None:
+		"""Dial one more client into the pool."""
+		async with self._pool_lock:
+			pool = self._robot_pool
+			if len(pool) >= self._pool_target:
+				return
+			robot = await self._dial()
+			if robot is None:
+				# Don't keep retrying extra connections the host refuses
+				self._pool_target = len(pool)
+			elif pool is self._robot_pool:
+				pool.append(robot)
+			else:
+				# Reconnected while dialing, this client belongs to the old pool
+				await robot.close()
+
+	async def _check_pool(self) -> None:
+		"""Close the extra pooled clients that no longer answer.
+
+		The status checks only cover the primary client, so without this a dead
+		extra would keep being handed out. get_robot dials replacements.
+		"""
+		pool = self._robot_pool
+		extras = pool[1:]
+		if not extras:
+			return
+		results = await asyncio.gather(
+			*(asyncio.wait_for(robot.get_machine_status(), timeout=10) for robot in extras),
+			return_exceptions=True,
+		)
+		dead = [robot for robot, result in zip(extras, results) if isinstance(result, BaseException)]
+		if not dead or pool is not self._robot_pool:
+			return
+		LOGGER.warning("Dropping %d dead connections to %s", len(dead), self._log_name)
+		for robot in dead:
+			pool.remove(robot)
+		# Entities may hold clients on the dead channels
+		self._run_callbacks()
+		for robot in dead:
+			with contextlib.suppress(Exception):
+				await robot.close()
+
+	async def _close_robots(self) -> None:
+		"""Close every pooled robot client."""
+		pool, self._robot_pool, self._robot = self._robot_pool, [], None
+		self._last_check = 0.0
+		self._run_callbacks()
+		for robot in pool:
+			# A client that is already broken may fail to close; still close the rest
+			with contextlib.suppress(Exception):
+				await robot.close()
+
+	def _run_callbacks(self) -> None:
+		"""Tell everyone holding clients that some channels were closed."""
+		# Snapshot, a callback may register or remove callbacks while we iterate
+		for callback in tuple(self._callbacks):
+			try:
+				callback()
+			except Exception:  # pylint: disable=broad-except
+				LOGGER.exception("Error in reconnect callback for %s", self._log_name)
+
+	def register_callback(self, callback: Callable[[], None]) -> None:
+		"""Register callback, called when the robot clients are closed."""
+		self._callbacks.add(callback)
+
+	def remove_callback(self, callback: Callable[[], None]) -> None:
+		"""Remove previously registered callback."""
+		self._callbacks.discard(callback)
+
 	async def get_motor_names(self):
-		robot = await self.setup_viam_conn()
-		motorNames = []
-		for resource in robot.resource_names:
-			if resource.type == "component":
-				if resource.subtype == "motor":
-					motorNames.append(resource.name)
-		return motorNames
+		await self.ensure_resources()
+		return self._motor_names
 
 	async def get_sensor_names(self):
+		await self.ensure_resources()
+		return self._sensor_names
+
+	async def ensure_resources(self) -> None:
+		"""Make sure the motor and sensor name caches are filled.
+
+		HA sets up the cover and sensor platforms concurrently, so callers
+		that arrive while a fetch is running wait on it instead of starting
+		their own.
+		"""
+		if self._motor_names is not None and self._sensor_names is not None:
+			return
+		if self._resources_future is None:
+			self._resources_future = asyncio.ensure_future(self._fetch_resource_names())
+		future = self._resources_future
+		try:
+			# Shielded so one cancelled caller doesn't abort the others' fetch
+			await asyncio.shield(future)
+		finally:
+			if future.done() and self._resources_future is future:
+				self._resources_future = None
+
+	async def _fetch_resource_names(self) -> None:
+		"""Fill both the motor and sensor name caches in one pass."""
 		robot = await self.setup_viam_conn()
+		motorNames = []
 		sensorNames = []
 		for resource in robot.resource_names:
-			if resource.type == "component":
-				if resource.subtype == "sensor":
-					sensorNames.append(resource.name)
-		return sensorNames
-	
+			if resource.type != "component":
+				continue
+			subtype = resource.subtype
+			if subtype == "motor":
+				motorNames.append(resource.name)
+			elif subtype == "sensor":
+				sensorNames.append(resource.name)
+		self._motor_names = motorNames
+		self._sensor_names = sensorNames
 
 	async def setup_viam_conn(self):
+		"""Return a verified robot client, dialing a new one if needed.
+
+		Callers that arrive while a check or dial is already running join it
+		instead of starting their own.
+		"""
+		if self._connect_future is None:
+			self._connect_future = asyncio.ensure_future(self._setup_viam_conn())
+		future = self._connect_future
+		try:
+			# Shielded so one cancelled caller doesn't abort the others' dial
+			return await asyncio.shield(future)
+		finally:
+			if future.done() and self._connect_future is future:
+				self._connect_future = None
+
+	async def _setup_viam_conn(self):
 		if self._robot is not None:
+			if time.monotonic() - self._last_check < self._liveness_every:
+				# Checked moments ago, don't pay for another round trip
+				return self._robot
 			try:
 				status = await asyncio.wait_for(self._robot.get_machine_status(), timeout=10)
 				if len(status.resources) > 0:
+					self._last_check = time.monotonic()
 					return self._robot
-				await self._robot.close()
-				self._robot = None
+				await self._close_robots()
 				LOGGER.warn("setup conn %s no status resources! reconnecting...", self._host)
 			except Exception as exc:
-				await self._robot.close()
+				await self._close_robots()
 				LOGGER.warn("setup conn %s excepted! %s reconnecting...", self._host, exc)
-				self._robot = None
+		r = await self._dial()
+		if r is not None:
+			self._robot = r
+			self._robot_pool = [r]
+			self._pool_target = self._pool_size
+			LOGGER.debug("got robot for %s", self._log_name)
+			return r
+		LOGGER.debug("none after connect to %s", self._log_name)
+		return None
+
+	async def _dial(self):
+		"""Open a new RobotClient to the host, or return None on failure."""
 		opts = RobotClient.Options.with_api_key(
 			api_key=self._api_key,
 			api_key_id=self._api_key_id
 		)
 		try:
-			LOGGER.warn("attempting connect to host %s", self._host)
-			r =  await asyncio.wait_for(RobotClient.at_address( self._host, opts), timeout=20)
-			self._robot = r
-			LOGGER.warn("got robot")
-			return r
+			LOGGER.debug("attempting connect to host %s", self._host)
+			return await asyncio.wait_for(RobotClient.at_address( self._host, opts), timeout=20)
 		except Exception as exc:
-			LOGGER.error(f'The coroutine for %s raised an exception: {exc!r}', self._log_name)
-		LOGGER.warn("none after connect")
+			LOGGER.error('The coroutine for %s raised an exception: %r', self._log_name, exc)
 		return None
 
 	async def start(self) -> None:
@@ -131,9 +343,44 @@ class Hub:
 		# not to delay startup.
 		self._loop_task = asyncio.create_task(self._reconnect_loop())
 
-		async with self._connected_lock:
-			self._connected = False
-		self._reconnect_event.set()
+		self._connected = False
+		await self._request_reconnect()
+
+	async def async_shutdown(self) -> None:
+		"""Stop the reconnect loop and close every robot client.
+
+		Safe to call more than once. Closing is bounded so a hung connection
+		can't hold up HA unloading the entry or shutting down.
+		"""
+		# Dials may be in flight in any of these, and would otherwise finish
+		# after unload and leave a live client behind
+		dialing = [
+			future
+			for future in (self._grow_task, self._connect_future, self._resources_future)
+			if future is not None
+		]
+		for task in (self._loop_task, self._wait_task, *dialing):
+			if task is not None:
+				task.cancel()
+		self._loop_task = None
+		self._wait_task = None
+		self._grow_task = None
+		self._connect_future = None
+		self._resources_future = None
+		self._connected = False
+		try:
+			await asyncio.wait_for(self._close_after(dialing), timeout=5.0)
+		except asyncio.TimeoutError:
+			LOGGER.warning("Timed out closing connections to %s", self._log_name)
+
+	async def _close_after(self, dialing: list[asyncio.Future]) -> None:
+		"""Wait for the cancelled dials to unwind, then close every client."""
+		if dialing:
+			await asyncio.wait(dialing)
+		# Anything a dial finished before it was cancelled is in the pool by now.
+		# _close_robots detaches the pool before awaiting, so nothing can pick
+		# up a client that is being closed
+		await self._close_robots()
 
 	async def _reconnect_loop(self) -> None:
 		while True:
@@ -147,62 +394,69 @@ class Hub:
 					self._log_name,
 					exc_info=True,
 				)
+				# The failed probe may not have queued another one. Back off, then
+				# ask for one so the loop neither spins nor waits forever.
+				await asyncio.sleep(self._loop_every)
+				await self._request_reconnect()
 
 	async def _reconnect_once(self) -> None:
-		# Wait and clear reconnection event
-		await self._reconnect_event.wait()
-		self._reconnect_event.clear()
+		# Wait for a reconnect request, then mark every request so far as handled
+		async with self._reconnect_cond:
+			await self._reconnect_cond.wait_for(lambda: self._reconnect_gen > self._reconnect_seen)
+			self._reconnect_seen = self._reconnect_gen
 		# If in connected state, wait and then verify connection.
-		async with self._connected_lock:
-			if self._connected:
-				await asyncio.sleep(self._loop_every)
+		if self._connected:
+			await asyncio.sleep(self._loop_every)
 		await self._try_connect()
 
+	async def _request_reconnect(self) -> None:
+		"""Ask the reconnect loop for another connection check."""
+		async with self._reconnect_cond:
+			self._reconnect_gen += 1
+			self._reconnect_cond.notify_all()
+
 	async def _try_connect(self) -> None:
 		"""Try connecting to the API client."""
-		async with self._tries_lock:
-			tries = self._tries
-			self._tries += 1
-			
 		success = await self.test_connection()
+		was_connected = self._connected
+		self._tries = 0 if success else self._tries + 1
+		self._connected = success
 		if success:
-			LOGGER.info("Successfully connected to %s", self._log_name)
-			async with self._tries_lock:
-				self._tries = 0
-			async with self._connected_lock:
-				self._connected = True
-			self._reconnect_event.set()
+			if not was_connected:
+				LOGGER.info("Successfully connected to %s", self._log_name)
+			await self._request_reconnect()
 		else:
-			async with self._connected_lock:
-				self._connected = False
+			# The robot's config may change while we can't see it
+			self._motor_names = None
+			self._sensor_names = None
 			LOGGER.warn(
 				"Can't connect to Viam API for %s",
 				self._log_name,
 			)
 			# Schedule re-connect in event loop in order not to delay HA
 			# startup. First connect is scheduled in tracked tasks.
-			async with self._wait_task_lock:
-				# Allow only one wait task at a time
-				# can happen if mDNS record received while waiting, then use existing wait task
-				if self._wait_task is not None:
-					return
+			# Allow only one wait task at a time
+			# can happen if mDNS record received while waiting, then use existing wait task.
+			# Nothing awaits between the check and the assignment, so this is atomic.
+			if self._wait_task is None:
 				self._wait_task = asyncio.create_task(self._wait_and_start_reconnect())
 
 
 	async def _wait_and_start_reconnect(self) -> None:
 		"""Wait for exponentially increasing time to issue next reconnect event."""
-		async with self._tries_lock:
-			tries = self._tries
+		tries = self._tries
 		# If not first re-try, wait and print message
 		# Cap wait time at 1 minute. This is because while working on the
 		# device (e.g. soldering stuff), users don't want to have to wait
 		# a long time for their device to show up in HA again
 		tries = min(tries, 10)  # prevent OverflowError
-		wait_time = int(round(min(1.8**tries, 60.0)))
+		cap = min(1.8**tries, 60.0)
+		# Jitter the wait so many clients that lost the same endpoint don't all
+		# retry in lockstep when it comes back
+		wait_time = random.uniform(cap * 0.5, cap)
 		if tries == 1:
 			LOGGER.info("Trying to reconnect to %s in the background", self._log_name)
-		LOGGER.info("Retrying %s in %d seconds", self._log_name, wait_time)
+		LOGGER.info("Retrying %s in %.1f seconds", self._log_name, wait_time)
 		await asyncio.sleep(wait_time)
-		async with self._wait_task_lock:
-			self._wait_task = None
-		self._reconnect_event.set()
+		self._wait_task = None
+		await self._request_reconnect()
@@ -1,36 +1,37 @@
 """Platform for sensor integration."""
 from __future__ import annotations
 
+from datetime import timedelta
 from typing import Any
-import threading
 
 # These constants are relevant to the type of entity we are using.
 # See below for how they are used.
-from homeassistant.components.sensor import (
-    SensorDeviceClass,
-    SensorEntity,
-    SensorStateClass,
-)
-from homeassistant.const import (
-    CONF_DEVICE_CLASS,
-    CONF_NAME,
-    CONF_OPTIMISTIC,
-    CONF_VALUE_TEMPLATE,
-)
+from homeassistant.components.sensor import SensorEntity
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.device_registry import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.update_coordinator import (
+    CoordinatorEntity,
+    DataUpdateCoordinator,
+    UpdateFailed,
+)
 
 from .const import DOMAIN
 import asyncio
-import time
 
 from viam import logging
 from viam.components.sensor import SensorClient
 
 LOGGER = logging.getLogger(__name__)
 
+# How often every sensor on the robot is read
+UPDATE_INTERVAL = timedelta(seconds=30)
+# Longest we back off to while polls keep failing
+MAX_UPDATE_INTERVAL = timedelta(minutes=5)
+# Polls in a row a sensor may fail before its old readings stop standing in
+MAX_READ_FAILURES = 3
+
 # This function is called as part of the __init__.async_setup_entry (via the
 # hass.config_entries.async_forward_entry_setup call)
 async def async_setup_entry(
@@ -38,23 +39,136 @@ async def async_setup_entry(
 	config_entry: ConfigEntry,
 	async_add_entities: AddEntitiesCallback,
 ) -> None:
-	"""Add cover for passed config_entry in HA."""
+	"""Add sensors for passed config_entry in HA."""
 	# The hub is loaded from the associated hass.data entry that was created in the
 	# __init__.async_setup_entry function
 	hub = hass.data[DOMAIN][config_entry.entry_id]
 	sensorNames = await hub.get_sensor_names()
-	LOGGER.info("sensorNames")
-	LOGGER.info(sensorNames)
+	LOGGER.debug("sensorNames %s", sensorNames)
+	# One coordinator reads every sensor per poll, and the entities share its result
+	coordinator = ViamSensorCoordinator(hass, hub, sensorNames)
+	# The hub outlives a reload, so don't leave it calling a dead coordinator
+	config_entry.async_on_unload(lambda: hub.remove_callback(coordinator._on_reconnect))
+	await coordinator.async_refresh()
 	# Add all entities to HA
-	# For now, we just assume one motor = one cover
-	async_add_entities(ViamSensor(hub, sensorName) for sensorName in sensorNames)
-
-class ViamSensor(SensorEntity):
-
-	def __init__(self, hub, sensorName) -> None:
-		self._name = sensorName
+	async_add_entities(ViamSensor(coordinator, sensorName) for sensorName in sensorNames)
+
+class ViamSensorCoordinator(DataUpdateCoordinator[dict[str, dict[str, Any]]]):
+	"""Reads every sensor on the robot in one concurrent pass."""
+
+	def __init__(self, hass: HomeAssistant, hub, sensorNames: list[str]) -> None:
+		super().__init__(
+			hass,
+			LOGGER,
+			name=f"{hub.hub_id} sensors",
+			update_interval=UPDATE_INTERVAL,
+			# Readings are plain dicts, so skip notifying entities when a poll
+			# returns exactly what the last one did
+			always_update=False,
+		)
 		self.hub = hub
-		self.attrs: Dict[str, Any] = {}
+		self._sensor_names = sensorNames
+		self._clients: dict[str, SensorClient] = {}
+		self._failures = 0
+		# Consecutive failed reads per sensor
+		self._read_failures: dict[str, int] = {}
+		# The hub drops its clients on reconnect, so the cached sensor clients
+		# must be rebuilt on the new channels.
+		hub.register_callback(self._on_reconnect)
+
+	def _on_reconnect(self) -> None:
+		"""Forget the sensor clients, their channels have been closed."""
+		self._clients = {}
+
+	async def _async_update_data(self) -> dict[str, dict[str, Any]]:
+		"""Fetch the readings of every sensor, backing off while that keeps failing."""
+		if not self.hub.online:
+			# The hub backs off its own reconnects. Keep polling at the normal
+			# rate, which costs no RPCs while offline, so sensors come back
+			# within one interval of the robot.
+			self._failures = 0
+			self.update_interval = UPDATE_INTERVAL
+			raise UpdateFailed(f"{self.hub.hub_id} is offline")
+		try:
+			readings = await self._fetch_readings()
+		except UpdateFailed:
+			self._failures += 1
+			failures = min(self._failures, 4)  # 30s doubled 4 times already passes the cap
+			self.update_interval = min(UPDATE_INTERVAL * 2**failures, MAX_UPDATE_INTERVAL)
+			raise
+		self._failures = 0
+		self.update_interval = UPDATE_INTERVAL
+		return readings
+
+	async def _fetch_readings(self) -> dict[str, dict[str, Any]]:
+		"""Fetch the readings of every sensor."""
+		clients = self._clients
+		missing = [sensorName for sensorName in self._sensor_names if sensorName not in clients]
+		if missing:
+			# Built aside and swapped in whole, so a failure or a reconnect part
+			# way through never leaves a cache that is missing sensors
+			built = dict(clients)
+			for sensorName in missing:
+				robot = await self.hub.get_robot()
+				if robot is None:
+					raise UpdateFailed(f"Can't reach {self.hub.hub_id}")
+				built[sensorName] = SensorClient(name=sensorName, channel=robot._channel)
+			if self._clients is not clients:
+				raise UpdateFailed(f"Connection to {self.hub.hub_id} was reset")
+			self._clients = clients = built
+		if not clients:
+			return {}
+		tasks = [asyncio.create_task(client.get_readings()) for client in clients.values()]
+		# One deadline for the whole poll rather than a timer per sensor. Reads
+		# that finished in time are kept, the stragglers count as failed.
+		try:
+			_, pending = await asyncio.wait(tasks, timeout=5.0)
+		finally:
+			for task in tasks:
+				task.cancel()
+		results = [_task_result(task, pending) for task in tasks]
+		# A sensor that failed this time keeps its last readings for a few polls,
+		# so one bad sensor doesn't blank out the rest. After that it is left out,
+		# which makes its entity unavailable.
+		previous = self.data or {}
+		readings: dict[str, dict[str, Any]] = {}
+		errors = []
+		for sensorName, result in zip(list(clients), results):
+			if isinstance(result, BaseException):
+				errors.append(result)
+				LOGGER.debug("reading sensor %s failed: %s", sensorName, result)
+				# Its channel may be dead, rebuild the client on the next poll
+				clients.pop(sensorName, None)
+				failures = self._read_failures.get(sensorName, 0) + 1
+				self._read_failures[sensorName] = failures
+				if failures < MAX_READ_FAILURES and sensorName in previous:
+					readings[sensorName] = previous[sensorName]
+			else:
+				self._read_failures.pop(sensorName, None)
+				readings[sensorName] = result
+		if errors and len(errors) == len(results):
+			raise UpdateFailed(f"Error reading sensors on {self.hub.hub_id}: {errors[0]}")
+		LOGGER.debug("sensor readings %s", readings)
+		return readings
+
+def _task_result(task: asyncio.Task, pending: set[asyncio.Task]) -> Any:
+	"""Return a finished read's readings, or the exception it failed with."""
+	if task in pending:
+		return TimeoutError("timed out")
+	if task.cancelled():
+		# e.g. its channel was closed by a reconnect mid-poll
+		return asyncio.CancelledError()
+	return task.exception() or task.result()
+
+class ViamSensor(CoordinatorEntity[ViamSensorCoordinator], SensorEntity):
+
+	def __init__(self, coordinator: ViamSensorCoordinator, sensorName) -> None:
+		super().__init__(coordinator)
+		self._name = sensorName
+		self.hub = coordinator.hub
+		self.attrs: Dict[str, Any] = (coordinator.data or {}).get(self._name, {})
+		# Availability at our last state write
+		self._written_available: bool | None = None
 
 		self._attr_unique_id = f"{self._name}_sensor"
 
@@ -62,28 +176,23 @@ class ViamSensor(SensorEntity):
 		# is used as the device name for device screens in the UI. This name is used on
 		# entity screens, and used to build the Entity ID that's used is automations etc.
 		self._attr_name = self._name
-
-
-	@property
-	def name(self) -> str:
-		"""Return the display name of this motor."""
-		return self._name
-	
-	@property
-	def device_info(self) -> DeviceInfo:
-		"""Information about this entity/device."""
-		return {
-			"identifiers": {(DOMAIN, self._name)},
+		# Never changes for the lifetime of the entity, so build it once
+		self._attr_device_info = DeviceInfo(
+			identifiers={(DOMAIN, self._name)},
 			# If desired, the name for the device could be different to the entity
-			"name": self._name,
-		}
+			name=self._name,
+		)
 
 	# This property is important to let HA know if this entity is online or not.
 	# If an entity is offline (return False), the UI will refelect this.
 	@property
-	def available(self, *args, **kwargs) -> bool:
-		"""Return True if hub is available."""
-		return self.hub.online
+	def available(self) -> bool:
+		"""Return True if hub is available and this sensor has current readings."""
+		return (
+			self.hub.online
+			and super().available
+			and self._name in (self.coordinator.data or {})
+		)
 
 	@property
 	def state(self):
@@ -93,12 +202,14 @@ class ViamSensor(SensorEntity):
 	def state_attributes(self) -> Dict[str, Any]:
 		return self.attrs
 
-	async def async_update(self):
-		LOGGER.info("updating sensor")
-		if self.available:
-			LOGGER.info("available")
-			robot = await self.hub.setup_viam_conn()
-			sensor = SensorClient(name=self._name, channel=robot._channel)
-			self.attrs = await sensor.get_readings()
-			LOGGER.info("attrs")
-			LOGGER.info(self.attrs)
+	@callback
+	def _handle_coordinator_update(self) -> None:
+		"""Pick up this sensor's readings from the coordinator's last poll."""
+		attrs = (self.coordinator.data or {}).get(self._name, self.attrs)
+		available = self.available
+		# Another sensor on the robot changed; nothing HA shows for this one did
+		if attrs == self.attrs and available == self._written_available:
+			return
+		self.attrs = attrs
+		self._written_available = available
+		super()._handle_coordinator_update()